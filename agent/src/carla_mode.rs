@@ -1,12 +1,16 @@
 //! CARLA Mode for GodView Agent
 //!
-//! This module handles input from the CARLA simulator via stdin instead of webcam.
-//! The Python bridge sends JSON-formatted detection data which we process and
-//! feed into the GodView Core v3 engines.
+//! This module handles input from the CARLA simulator. The Python bridge
+//! preferably sends fixed-schema binary frame packets over a Unix socket
+//! (path in `AGENT_SOCK`); without a socket we fall back to the legacy
+//! JSON-lines-over-stdin protocol. One process serves every simulated
+//! vehicle: each packet carries a u16 agent id, and detections are
+//! routed to that agent's own set of GodView Core v3 engines.
 
 use anyhow::Result;
 use serde::Deserialize;
-use std::io::{self, BufRead};
+use std::io::{self, BufRead, Read};
+use std::os::unix::net::UnixStream;
 use std::time::{SystemTime, UNIX_EPOCH};
 // use tokio::time::{sleep, Duration};  // Not needed for CARLA mode
 // use zenoh::prelude::*;  // Removed in Zenoh 1.0
@@ -27,6 +31,9 @@ use crate::GlobalHazardPacket;
 /// Detection data from CARLA Python bridge
 #[derive(Debug, Deserialize)]
 pub struct CARLADetection {
+    /// Which vehicle's logical agent this detection belongs to
+    #[serde(default)]
+    pub agent_id: u16,
     /// Bounding box [x1, y1, x2, y2] in pixels
     pub bbox: [f32; 4],
     /// Detection confidence (0.0-1.0)
@@ -45,49 +52,129 @@ pub struct CARLADetection {
     pub timestamp: f64,
 }
 
-/// Run GodView agent in CARLA mode (reads from stdin)
+/// Map a COCO class id from the bridge back to the class name
+fn coco_class_name(id: u16) -> &'static str {
+    match id {
+        0 => "person",
+        1 => "bicycle",
+        2 => "car",
+        3 => "motorcycle",
+        5 => "bus",
+        7 => "truck",
+        _ => "unknown",
+    }
+}
+
+/// Read one binary frame packet from the bridge socket
+///
+/// Wire layout (all little-endian): a 38-byte header
+/// `[agent_id: u16][k: u32][timestamp: f64][gps_lat: f64][gps_lon: f64][gps_alt: f32][heading: f32]`
+/// followed by `k` xyxy boxes as `[f32; 4]`, `k` confidences as `f32`
+/// and `k` COCO class ids as `u16` - three contiguous arrays, no
+/// per-detection framing.
+///
+/// Returns `Ok(None)` when the bridge has closed the connection.
+fn read_frame(stream: &mut UnixStream) -> Result<Option<Vec<CARLADetection>>> {
+    let mut header = [0u8; 38];
+    if let Err(e) = stream.read_exact(&mut header) {
+        if e.kind() == io::ErrorKind::UnexpectedEof {
+            return Ok(None);
+        }
+        return Err(e.into());
+    }
+    let agent_id = u16::from_le_bytes(header[0..2].try_into()?);
+    let k = u32::from_le_bytes(header[2..6].try_into()?) as usize;
+    let timestamp = f64::from_le_bytes(header[6..14].try_into()?);
+    let gps_lat = f64::from_le_bytes(header[14..22].try_into()?);
+    let gps_lon = f64::from_le_bytes(header[22..30].try_into()?);
+    let gps_alt = f32::from_le_bytes(header[30..34].try_into()?);
+    let heading = f32::from_le_bytes(header[34..38].try_into()?);
+
+    let mut buf = vec![0u8; k * (16 + 4 + 2)];
+    stream.read_exact(&mut buf)?;
+    let (boxes, rest) = buf.split_at(16 * k);
+    let (confs, classes) = rest.split_at(4 * k);
+
+    let dets = (0..k)
+        .map(|i| {
+            let b = &boxes[16 * i..16 * (i + 1)];
+            let class_id =
+                u16::from_le_bytes(classes[2 * i..2 * i + 2].try_into().unwrap());
+            CARLADetection {
+                agent_id,
+                bbox: [
+                    f32::from_le_bytes(b[0..4].try_into().unwrap()),
+                    f32::from_le_bytes(b[4..8].try_into().unwrap()),
+                    f32::from_le_bytes(b[8..12].try_into().unwrap()),
+                    f32::from_le_bytes(b[12..16].try_into().unwrap()),
+                ],
+                confidence: f32::from_le_bytes(
+                    confs[4 * i..4 * i + 4].try_into().unwrap(),
+                ),
+                class_name: coco_class_name(class_id).to_string(),
+                gps_lat,
+                gps_lon,
+                gps_alt,
+                heading,
+                timestamp,
+            }
+        })
+        .collect();
+    Ok(Some(dets))
+}
+
+/// Per-vehicle engine state inside the single multiplexed process
+///
+/// Each logical agent keeps its own AS-EKF, spatial index, track
+/// manager and signing key, exactly as the old one-process-per-vehicle
+/// setup did - only the address space is shared now.
+struct AgentState {
+    label: String,
+    ekf: AugmentedStateFilter,
+    spatial_engine: SpatialEngine,
+    track_manager: TrackManager,
+    signing_key: SigningKey,
+}
+
+impl AgentState {
+    fn new(id: u16) -> Self {
+        // 6D state [x, y, z, vx, vy, vz] to match godview_core
+        let initial_state = DVector::from_vec(vec![
+            0.0, 0.0, 0.0,  // Position (will be updated with first GPS)
+            0.0, 0.0, 0.0,  // Velocity
+        ]);
+        let initial_cov = DMatrix::identity(6, 6) * 10.0;
+        let q = DMatrix::identity(6, 6) * 0.01;  // Process noise
+        let r = DMatrix::identity(3, 3) * 0.1;   // Measurement noise (position only)
+
+        AgentState {
+            label: format!("carla_vehicle_{}", id),
+            ekf: AugmentedStateFilter::new(initial_state, initial_cov, q, r, 20),
+            spatial_engine: SpatialEngine::new(Resolution::Ten),
+            track_manager: TrackManager::new(TrackingConfig::default()),
+            signing_key: SigningKey::generate(&mut OsRng),
+        }
+    }
+}
+
+/// Run GodView agent in CARLA mode (reads from a Unix socket or stdin)
 pub async fn run_carla_mode() -> Result<()> {
     println!("╔════════════════════════════════════════════╗");
     println!("║   GODVIEW AGENT V3 (CARLA MODE)           ║");
     println!("╚════════════════════════════════════════════╝");
     println!();
 
-    // Get agent ID from environment
-    let agent_id = std::env::var("AGENT_ID")
-        .unwrap_or_else(|_| "carla_agent_unknown".to_string());
-    
     println!("📍 Agent Configuration:");
-    println!("   ID: {}", agent_id);
-    println!("   Mode: CARLA (stdin input)");
+    println!("   Mode: CARLA (multiplexed, one process for all vehicles)");
     println!();
 
-    // ========== INITIALIZE V3 ENGINES ==========
-    
-    println!("🔧 Initializing GodView Core v3 engines...");
-    
-    // Initialize AS-EKF with 6D state [x, y, z, vx, vy, vz] to match godview_core
-    let initial_state = DVector::from_vec(vec![
-        0.0, 0.0, 0.0,  // Position (will be updated with first GPS)
-        0.0, 0.0, 0.0,  // Velocity
-    ]);
-    let initial_cov = DMatrix::identity(6, 6) * 10.0;
-    let Q = DMatrix::identity(6, 6) * 0.01;  // Process noise
-    let R = DMatrix::identity(3, 3) * 0.1;   // Measurement noise (position only)
-    
-    let mut ekf = AugmentedStateFilter::new(initial_state, initial_cov, Q, R, 20);
-    println!("   ✅ AS-EKF initialized (lag depth: 20 states)");
-    
-    // Initialize Spatial Engine
-    let mut spatial_engine = SpatialEngine::new(Resolution::Ten);
-    println!("   ✅ Spatial Engine initialized (H3 Resolution 10)");
-    
-    // Initialize Track Manager for distributed data association
-    let mut track_manager = TrackManager::new(TrackingConfig::default());
-    println!("   ✅ Track Manager initialized (GNN + CI + Highlander)");
-    
-    // Initialize Security
-    let signing_key = SigningKey::generate(&mut OsRng);
-    println!("   ✅ Security initialized (Ed25519)");
+    // ========== PER-AGENT V3 ENGINES ==========
+
+    // Engine state (AS-EKF, spatial engine, track manager, Ed25519
+    // key) is created lazily per agent id as packets arrive
+    let mut agents: std::collections::HashMap<u16, AgentState> =
+        std::collections::HashMap::new();
+    println!("🔧 Per-agent engine state ready (lazy init on first packet)");
     println!();
 
     // ========== INITIALIZE ZENOH ==========
@@ -101,41 +188,77 @@ pub async fn run_carla_mode() -> Result<()> {
     println!("📡 Publishing to: {}", key);
     println!();
 
-    // ========== READ FROM STDIN ==========
-    
+    // ========== CONNECT TO BRIDGE ==========
+
+    let mut sock = match std::env::var("AGENT_SOCK") {
+        Ok(path) => match UnixStream::connect(&path) {
+            Ok(s) => {
+                println!("🔌 Connected to bridge socket: {}", path);
+                Some(s)
+            }
+            Err(e) => {
+                eprintln!("⚠️  Could not connect to {} ({}) - falling back to stdin", path, e);
+                None
+            }
+        },
+        Err(_) => None,
+    };
+
     println!("🎬 Waiting for detections from CARLA bridge...");
     println!("════════════════════════════════════════════");
     println!();
-    
+
     let stdin = io::stdin();
+    let mut lines = stdin.lock().lines();
     let mut detection_count = 0u64;
     let mut last_gps: Option<(f64, f64, f32)> = None;
-    
-    for line in stdin.lock().lines() {
-        let line = match line {
-            Ok(l) => l,
-            Err(e) => {
-                eprintln!("❌ Error reading stdin: {}", e);
-                break;
-            }
-        };
-        
-        // Skip empty lines
-        if line.trim().is_empty() {
-            continue;
-        }
-        
-        // Parse JSON detection
-        let detection: CARLADetection = match serde_json::from_str(&line) {
-            Ok(d) => d,
-            Err(e) => {
-                eprintln!("⚠️  Failed to parse detection: {}", e);
+    let mut pending: std::collections::VecDeque<CARLADetection> =
+        std::collections::VecDeque::new();
+
+    loop {
+        let detection = match pending.pop_front() {
+            Some(d) => d,
+            None => {
+                // Refill from the active transport
+                if let Some(stream) = sock.as_mut() {
+                    match read_frame(stream) {
+                        Ok(Some(dets)) => pending.extend(dets),
+                        Ok(None) => break, // bridge closed the socket
+                        Err(e) => {
+                            // Framing is lost after a bad packet
+                            eprintln!("⚠️  Failed to parse frame: {}", e);
+                            break;
+                        }
+                    }
+                } else {
+                    match lines.next() {
+                        Some(Ok(line)) => {
+                            if line.trim().is_empty() {
+                                continue;
+                            }
+                            match serde_json::from_str::<CARLADetection>(&line) {
+                                Ok(d) => pending.push_back(d),
+                                Err(e) => eprintln!("⚠️  Failed to parse detection: {}", e),
+                            }
+                        }
+                        Some(Err(e)) => {
+                            eprintln!("❌ Error reading stdin: {}", e);
+                            break;
+                        }
+                        None => break,
+                    }
+                }
                 continue;
             }
         };
-        
+
         detection_count += 1;
-        
+
+        // Route to this agent's engines, creating them on first sight
+        let state = agents
+            .entry(detection.agent_id)
+            .or_insert_with(|| AgentState::new(detection.agent_id));
+
         // Update last known GPS
         last_gps = Some((detection.gps_lat, detection.gps_lon, detection.gps_alt));
         
@@ -168,7 +291,7 @@ pub async fn run_carla_mode() -> Result<()> {
         };
 
         // ========== UPDATE SPATIAL ENGINE ==========
-        if let Err(e) = spatial_engine.update_entity(entity.clone()) {
+        if let Err(e) = state.spatial_engine.update_entity(entity.clone()) {
             eprintln!("⚠️  Spatial engine error: {}", e);
         }
 
@@ -178,7 +301,7 @@ pub async fn run_carla_mode() -> Result<()> {
             global_pos[1],
             global_pos[2]
         ]);
-        ekf.update_oosm(measurement, current_time);
+        state.ekf.update_oosm(measurement, current_time);
         
         // ========== PROCESS THROUGH TRACK MANAGER ==========
         // Convert detection class to class_id (0=person, 1=car, 2=truck, etc.)
@@ -200,7 +323,7 @@ pub async fn run_carla_mode() -> Result<()> {
         };
         
         // Run through GNN + Covariance Intersection + Highlander pipeline
-        let canonical_id = match track_manager.process_packet(&core_packet) {
+        let canonical_id = match state.track_manager.process_packet(&core_packet) {
             Ok(id) => id,
             Err(e) => {
                 eprintln!("⚠️  Track manager error: {}", e);
@@ -212,11 +335,11 @@ pub async fn run_carla_mode() -> Result<()> {
         let packet = GlobalHazardPacket {
             entity: entity.clone(),
             camera_pos: [0.0, 0.0, 0.0],  // Not applicable in CARLA mode
-            agent_id: agent_id.clone(),
+            agent_id: state.label.clone(),
         };
 
         let payload = serde_json::to_vec(&packet)?;
-        let signed_packet = SignedPacket::new(payload, &signing_key, None);
+        let signed_packet = SignedPacket::new(payload, &state.signing_key, None);
         
         // ========== PUBLISH VIA ZENOH ==========
         let signed_payload = serde_json::to_vec(&signed_packet)?;
@@ -238,7 +361,7 @@ pub async fn run_carla_mode() -> Result<()> {
         }
 
         // Predict EKF forward
-        ekf.predict(0.05, current_time);  // 20 FPS = 0.05s
+        state.ekf.predict(0.05, current_time);  // 20 FPS = 0.05s
     }
     
     println!("\n✅ CARLA mode ended");